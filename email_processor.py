@@ -5,24 +5,160 @@ Processes emails from PostgreSQL database based on JSON rules and performs actio
 """
 
 import os
+import re
+import sys
 import json
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from enum import IntEnum
 from email.utils import parsedate_to_datetime
+from functools import partial
+from itertools import islice
+import ahocorasick
+import httplib2
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from selectolax.lexbor import LexborHTMLParser
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+# Hyperscan (x86 only) scans needles with SIMD; fall back to pyahocorasick without it
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Fields that hold searchable text, keyed by the name used in rules
+TEXT_FIELDS = ('from', 'to', 'subject', 'body')
+
+# Email column holding each header text field
+FIELD_SOURCES = {'from': 'sender', 'to': 'recipient', 'subject': 'subject'}
+
+# SQL expression for each text field, matching lowercase_fields (NULL -> '').
+# Must stay identical to the expressions indexed in schema.sql.
+FIELD_COLUMNS = {
+    'from': "COALESCE(sender, '')",
+    'to': "COALESCE(recipient, '')",
+    'subject': "COALESCE(subject, '')",
+}
+
+
+class Op(IntEnum):
+    """Condition operators, resolved from predicate strings when rules are compiled."""
+    CONTAINS = 1
+    NOT_CONTAINS = 2
+    EQUALS = 3
+    NOT_EQUALS = 4
+    LESS_THAN = 5
+    GREATER_THAN = 6
+
+
+STRING_PREDICATES = {
+    'contains': Op.CONTAINS,
+    'does_not_contain': Op.NOT_CONTAINS,
+    'not_contains': Op.NOT_CONTAINS,
+    'equals': Op.EQUALS,
+    'does_not_equal': Op.NOT_EQUALS,
+    'not_equals': Op.NOT_EQUALS,
+}
+
+DATE_PREDICATES = {
+    'less_than': Op.LESS_THAN,
+    'greater_than': Op.GREATER_THAN,
+}
+
+# Days per date unit ('months' is approximate)
+DATE_UNITS = {'days': 1, 'months': 30}
+
+RULE_PREDICATES = {'all': all, 'any': any}
+
+# Labels removed from a message when it is moved to the key mailbox
+MOVE_CONFLICTS = {
+    'TRASH': frozenset(('INBOX', 'SPAM')),
+    'INBOX': frozenset(('TRASH', 'SPAM')),
+}
+
+# Rows fetched per round-trip when streaming emails from the server-side cursor
+EMAIL_FETCH_SIZE = 500
+
+# Maximum message IDs accepted by a single messages.batchModify call
+BATCH_MODIFY_LIMIT = 1000
+
+# Threads evaluating rules; the needle scanners run in C extensions
+EVALUATION_WORKERS = os.cpu_count() or 1
+
+# Concurrent batchModify calls. Each costs 50 quota units and Gmail allows
+# 250 units per user per second, so keep this small.
+ACTION_WORKERS = 4
+
+OPS = {
+    Op.CONTAINS: lambda email_value, value: value in email_value,
+    Op.NOT_CONTAINS: lambda email_value, value: value not in email_value,
+    Op.EQUALS: lambda email_value, value: email_value == value,
+    Op.NOT_EQUALS: lambda email_value, value: email_value != value,
+    # Email is less than X days old (received after threshold)
+    Op.LESS_THAN: lambda date_received, threshold: date_received > threshold,
+    # Email is greater than X days old (received before threshold)
+    Op.GREATER_THAN: lambda date_received, threshold: date_received < threshold,
+}
+
+# Columns every processing pass needs: IDs, labels for moves, and what is printed
+BASE_COLUMNS = ('id', 'gmail_message_id', 'subject', 'sender', 'date_received', 'labels')
+
+# Extra columns selected only when some rule condition inspects the field
+FIELD_SELECT_COLUMNS = {
+    'to': ('recipient',),
+    'body': ('body_text', 'body_html'),
+}
+
+# SQL comparison for each string operator; LIKE patterns are built in _rule_to_sql.
+# Both sides are lowercased so lower(COALESCE(...)) trigram indexes can serve them.
+SQL_OPS = {
+    Op.CONTAINS: 'LIKE',
+    Op.NOT_CONTAINS: 'NOT LIKE',
+    Op.EQUALS: '=',
+    Op.NOT_EQUALS: '<>',
+}
+
+# Rule and condition after load-time normalization. For string conditions
+# value is the lowercased needle; for date conditions it is a timedelta.
+# A rule's needle conditions are also folded into required/forbidden needle
+# bitmasks; checks holds the remaining conditions evaluated one by one.
+CompiledRule = namedtuple('CompiledRule', [
+    'description', 'match', 'conditions', 'actions', 'required', 'forbidden', 'checks'
+])
+CompiledCondition = namedtuple('CompiledCondition', ['field', 'op', 'value', 'needle_id'])
+
+# Everything derived from a rules file, cached while the file is unchanged
+RuleSet = namedtuple('RuleSet', ['rules', 'compiled_rules', 'matchers', 'needle_ids'])
+
+# Maximum number of compiled rule sets kept per process
+RULES_CACHE_SIZE = 8
+
+
+def _on_hyperscan_match(needle_id, start, end, flags, found):
+    """Record a Hyperscan match in the context set."""
+    found.add(needle_id)
+
 
 class EmailRuleProcessor:
     """Processes emails based on rules and executes actions."""
 
+    # Compiled rule sets shared by all instances, keyed by (path, mtime, size), LRU order
+    _rule_set_cache = OrderedDict()
+
     def __init__(self, rules_file='rules.json'):
         """
         Initialize the email processor.
@@ -30,9 +166,18 @@ class EmailRuleProcessor:
         Args:
             rules_file: Path to JSON file containing rules
         """
-        self.rules = self.load_rules(rules_file)
+        rule_set = self._load_rule_set(rules_file)
+        self.rules = rule_set.rules
+        self.compiled_rules = rule_set.compiled_rules
+        self.matchers = rule_set.matchers
+        self.needle_ids = rule_set.needle_ids
+        fields_needed = self._fields_needed()
+        self.text_fields = tuple(field for field in TEXT_FIELDS if field in fields_needed)
         self.db_conn = None
         self.gmail_service = None
+        self.credentials = None
+        # Per-thread Hyperscan scratch space and Gmail HTTP connections
+        self._thread_state = threading.local()
         self.connect_database()
 
     def connect_database(self):
@@ -46,9 +191,22 @@ class EmailRuleProcessor:
                 password=os.getenv('DB_PASSWORD'),
                 sslmode=os.getenv('DB_SSLMODE', 'require')
             )
-            print("✓ Connected to PostgreSQL database")
+            # Reads outside the email stream don't need a transaction
+            self.db_conn.autocommit = True
+
+            # Parse and plan the token lookup once per connection
+            cursor = self.db_conn.cursor()
+            cursor.execute("""
+                PREPARE get_token AS
+                SELECT token, refresh_token, token_uri, client_id,
+                       client_secret, scopes, expiry
+                FROM oauth_tokens
+                WHERE user_email = $1
+            """)
+            cursor.close()
+            logger.info("✓ Connected to PostgreSQL database")
         except Exception as e:
-            print(f"✗ Error connecting to database: {e}")
+            logger.error("✗ Error connecting to database: %s", e)
             raise
 
     def authenticate_gmail(self):
@@ -59,12 +217,7 @@ class EmailRuleProcessor:
                 raise ValueError("GMAIL_USER_EMAIL not set in .env")
 
             cursor = self.db_conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT token, refresh_token, token_uri, client_id,
-                       client_secret, scopes, expiry
-                FROM oauth_tokens
-                WHERE user_email = %s
-            """, (user_email,))
+            cursor.execute("EXECUTE get_token(%s)", (user_email,))
 
             result = cursor.fetchone()
             cursor.close()
@@ -87,18 +240,19 @@ class EmailRuleProcessor:
             # Refresh if expired
             if not creds.valid:
                 if creds.expired and creds.refresh_token:
-                    print("Refreshing expired token...")
+                    logger.info("Refreshing expired token...")
                     creds.refresh(Request())
                 else:
                     raise ValueError("Credentials are invalid and cannot be refreshed")
 
             # We need modify scope, not just readonly
             # Build service with gmail.modify scope
+            self.credentials = creds
             self.gmail_service = build('gmail', 'v1', credentials=creds)
-            print("✓ Authenticated to Gmail API")
+            logger.info("✓ Authenticated to Gmail API")
 
         except Exception as e:
-            print(f"✗ Error authenticating: {e}")
+            logger.error("✗ Error authenticating: %s", e)
             raise
 
     def load_rules(self, rules_file):
@@ -114,281 +268,705 @@ class EmailRuleProcessor:
         try:
             with open(rules_file, 'r') as f:
                 data = json.load(f)
-            print(f"✓ Loaded {len(data.get('rules', []))} rules from {rules_file}")
+            logger.info("✓ Loaded %d rules from %s", len(data.get('rules', [])), rules_file)
             return data.get('rules', [])
         except FileNotFoundError:
-            print(f"✗ Rules file not found: {rules_file}")
+            logger.error("✗ Rules file not found: %s", rules_file)
             return []
         except json.JSONDecodeError as e:
-            print(f"✗ Error parsing JSON: {e}")
+            logger.error("✗ Error parsing JSON: %s", e)
             return []
 
-    def evaluate_condition(self, condition, email):
+    def _load_rule_set(self, rules_file):
         """
-        Evaluate a single condition against an email.
+        Load and compile rules, reusing the compiled result while the file is unchanged.
+
+        Args:
+            rules_file: Path to JSON rules file
+
+        Returns:
+            RuleSet: Loaded rules and their compiled form
+        """
+        try:
+            stat = os.stat(rules_file)
+            key = (os.path.abspath(rules_file), stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            key = None
+
+        cache = self._rule_set_cache
+        if key in cache:
+            cache.move_to_end(key)
+            rule_set = cache[key]
+            logger.info("✓ Loaded %d rules from %s (cached)", len(rule_set.rules), rules_file)
+            return rule_set
+
+        self.rules = self.load_rules(rules_file)
+        self.needle_ids = {}
+        compiled_rules = self._compile_rules()
+        self.matchers = self._build_matchers()
+        rule_set = RuleSet(self.rules, compiled_rules, self.matchers, self.needle_ids)
+
+        if key is not None:
+            cache[key] = rule_set
+            while len(cache) > RULES_CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return rule_set
+
+    def _compile_rules(self):
+        """
+        Normalize rules once so evaluation does no string parsing per email.
+
+        Every distinct contains/does_not_contain needle is given an ID in
+        self.needle_ids for _build_matchers.
+
+        Returns:
+            list: CompiledRule for each loaded rule
+        """
+        compiled_rules = []
+
+        for rule_idx, rule in enumerate(self.rules, 1):
+            predicate = rule.get('predicate', 'all').lower()
+            match = RULE_PREDICATES.get(predicate)
+            if match is None:
+                logger.warning("Unknown rule predicate '%s'", predicate)
+
+            conditions = []
+            for condition in rule.get('conditions', []):
+                compiled = self._compile_condition(condition)
+                if compiled is not None:
+                    conditions.append(compiled)
+                elif match is all:
+                    # A condition that can never match fails the whole rule
+                    match = None
+
+            if not rule.get('conditions'):
+                match = None
+
+            # Cheapest conditions first so short-circuiting skips the expensive ones
+            conditions.sort(key=self._condition_cost)
+
+            # Fold needle conditions into bitmasks over scan_email's result
+            required = 0
+            forbidden = 0
+            checks = []
+            for condition in conditions:
+                if condition.needle_id is None:
+                    checks.append(condition)
+                elif condition.op == Op.CONTAINS:
+                    required |= 1 << condition.needle_id
+                else:
+                    forbidden |= 1 << condition.needle_id
+
+            compiled_rules.append(CompiledRule(
+                description=rule.get('description', f'Rule {rule_idx}'),
+                match=match,
+                conditions=conditions,
+                actions=rule.get('actions', []),
+                required=required,
+                forbidden=forbidden,
+                checks=checks
+            ))
+
+        return compiled_rules
+
+    def _build_matchers(self):
+        """
+        Build one multi-pattern matcher per text field over its needles, so
+        each email is scanned once per field instead of once per condition.
+
+        Uses a Hyperscan block-mode database when hyperscan is installed and
+        an Aho-Corasick automaton otherwise.
+
+        Returns:
+            dict: Field name -> Hyperscan database or Aho-Corasick automaton
+        """
+        field_needles = {}
+        for (field, needle), needle_id in self.needle_ids.items():
+            field_needles.setdefault(field, {})[needle] = needle_id
+
+        matchers = {}
+        for field, needles in field_needles.items():
+            if hyperscan is not None:
+                # Fields are lowercased before scanning, so needles match as escaped literals.
+                # No HS_FLAG_SINGLEMATCH: it can drop matches of overlapping literals, and
+                # scan_email's set already collapses repeats.
+                database = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+                database.compile(
+                    expressions=[re.escape(needle.encode('utf-8')) for needle in needles],
+                    ids=list(needles.values()),
+                    elements=len(needles)
+                )
+                matchers[field] = database
+            else:
+                automaton = ahocorasick.Automaton()
+                for needle, needle_id in needles.items():
+                    automaton.add_word(needle, needle_id)
+                automaton.make_automaton()
+                matchers[field] = automaton
+
+        return matchers
+
+    def _compile_condition(self, condition):
+        """
+        Compile a single condition dict.
 
         Args:
             condition: Condition dict with field, predicate, value
+
+        Returns:
+            CompiledCondition, or None if the condition can never match
+        """
+        field = self.normalize_field(condition.get('field', ''))
+        predicate = condition.get('predicate', '').lower()
+
+        if field == 'date_received':
+            op = DATE_PREDICATES.get(predicate)
+            unit = condition.get('unit', 'days').lower()
+            if op is None:
+                logger.warning("Unknown date predicate '%s'", predicate)
+                return None
+            if unit not in DATE_UNITS:
+                logger.warning("Unknown unit '%s'", unit)
+                return None
+            threshold = timedelta(days=condition.get('value', 0) * DATE_UNITS[unit])
+            return CompiledCondition(field, op, threshold, None)
+
+        if field not in TEXT_FIELDS:
+            logger.warning("Unknown field '%s'", field)
+            return None
+
+        op = STRING_PREDICATES.get(predicate)
+        if op is None:
+            logger.warning("Unknown predicate '%s'", predicate)
+            return None
+
+        needle = str(condition.get('value', '')).lower()
+        needle_id = None
+
+        # Empty needles match everything; leave them to the plain check
+        if op in (Op.CONTAINS, Op.NOT_CONTAINS) and needle:
+            needle_id = self.needle_ids.get((field, needle))
+            if needle_id is None:
+                needle_id = len(self.needle_ids)
+                self.needle_ids[(field, needle)] = needle_id
+
+        return CompiledCondition(field, op, needle, needle_id)
+
+    @staticmethod
+    def _condition_cost(condition):
+        """
+        Estimate the relative cost of evaluating a compiled condition.
+
+        Args:
+            condition: CompiledCondition
+
+        Returns:
+            int: Sort key, lower is cheaper
+        """
+        if condition.field == 'date_received':
+            return 0
+        if condition.field == 'body':
+            return 3
+        if condition.op in (Op.EQUALS, Op.NOT_EQUALS):
+            return 1
+        return 2
+
+    @staticmethod
+    def normalize_field(field):
+        """Map a rule field name to its canonical form ('message' -> 'body')."""
+        field = field.lower()
+        return 'body' if field == 'message' else field
+
+    @staticmethod
+    def plain_body(email):
+        """
+        Get the visible text of an email body.
+
+        Uses body_text when present; otherwise strips tags, scripts and styles
+        from body_html so conditions don't scan markup.
+
+        Args:
+            email: Email dict from database
+
+        Returns:
+            str: Plain-text body
+        """
+        text_body = email.get('body_text', '') or ''
+        if text_body.strip():
+            return text_body
+
+        html_body = email.get('body_html', '') or ''
+        if not html_body:
+            return text_body
+
+        tree = LexborHTMLParser(html_body)
+        tree.strip_tags(['script', 'style'])
+        node = tree.body or tree.root
+        if node is None:
+            return ''
+        # Collapse the whitespace left between text nodes, as a browser would
+        return ' '.join(node.text(separator=' ').split())
+
+    def lowercase_fields(self, email):
+        """
+        Lowercase, once, every text field that some rule condition reads.
+
+        Fields no rule references are skipped entirely. Plain str.lower() is
+        used throughout: CPython already special-cases ASCII strings, and it
+        benchmarks faster than str.translate or a bytes round-trip.
+
+        Args:
             email: Email dict from database
 
+        Returns:
+            dict: Field name (from, to, subject, body) -> lowercased text
+        """
+        fields = {}
+        for field in self.text_fields:
+            if field == 'body':
+                fields[field] = self.plain_body(email).lower()
+            else:
+                fields[field] = (email.get(FIELD_SOURCES[field]) or '').lower()
+        return fields
+
+    def _hyperscan_scratch(self, field):
+        """
+        Get this thread's Hyperscan scratch space for a field's database.
+
+        A scratch may only be used by one scan at a time, so each worker
+        thread allocates its own.
+
+        Args:
+            field: Field whose database will be scanned
+
+        Returns:
+            hyperscan.Scratch
+        """
+        scratches = getattr(self._thread_state, 'scratches', None)
+        if scratches is None:
+            scratches = self._thread_state.scratches = {}
+        if field not in scratches:
+            scratches[field] = hyperscan.Scratch(self.matchers[field])
+        return scratches[field]
+
+    def scan_email(self, fields):
+        """
+        Run each field's matcher over an email once.
+
+        Args:
+            fields: Lowercased fields from lowercase_fields
+
+        Returns:
+            int: Bitset with bit N set when needle ID N was found
+        """
+        found = set()
+        for field, matcher in self.matchers.items():
+            if hyperscan is not None:
+                matcher.scan(fields[field].encode('utf-8'),
+                             match_event_handler=_on_hyperscan_match, context=found,
+                             scratch=self._hyperscan_scratch(field))
+            else:
+                found.update(needle_id for _, needle_id in matcher.iter(fields[field]))
+
+        matched = 0
+        for needle_id in found:
+            matched |= 1 << needle_id
+        return matched
+
+    def evaluate_condition(self, condition, email, fields=None, matched=None, now=None):
+        """
+        Evaluate a single compiled condition against an email.
+
+        Args:
+            condition: CompiledCondition from _compile_rules
+            email: Email dict from database
+            fields: Lowercased fields from lowercase_fields (computed if omitted)
+            matched: Needle bitset from scan_email (computed if omitted)
+            now: Reference time for date conditions (current time if omitted)
+
         Returns:
             bool: True if condition matches
         """
-        field = condition.get('field', '').lower()
-        predicate = condition.get('predicate', '').lower()
-        value = condition.get('value', '')
-
-        # Get the field value from email
-        email_value = None
-
-        if field == 'from':
-            email_value = email.get('sender', '').lower()
-        elif field == 'to':
-            email_value = email.get('recipient', '').lower()
-        elif field == 'subject':
-            email_value = email.get('subject', '').lower()
-        elif field == 'message' or field == 'body':
-            # Check both text and HTML body
-            text_body = email.get('body_text', '') or ''
-            html_body = email.get('body_html', '') or ''
-            email_value = (text_body + ' ' + html_body).lower()
-        elif field == 'date_received':
-            return self.evaluate_date_condition(condition, email)
-        else:
-            print(f"Warning: Unknown field '{field}'")
-            return False
+        if condition.field == 'date_received':
+            return self.evaluate_date_condition(condition, email, now)
 
-        # String predicates
-        value_lower = str(value).lower()
-
-        if predicate == 'contains':
-            return value_lower in email_value
-        elif predicate == 'does_not_contain' or predicate == 'not_contains':
-            return value_lower not in email_value
-        elif predicate == 'equals':
-            return email_value == value_lower
-        elif predicate == 'does_not_equal' or predicate == 'not_equals':
-            return email_value != value_lower
-        else:
-            print(f"Warning: Unknown predicate '{predicate}'")
-            return False
+        if fields is None:
+            fields = self.lowercase_fields(email)
+
+        if condition.needle_id is not None:
+            if matched is None:
+                matched = self.scan_email(fields)
+            found = bool(matched >> condition.needle_id & 1)
+            return found if condition.op == Op.CONTAINS else not found
+
+        return OPS[condition.op](fields[condition.field], condition.value)
 
-    def evaluate_date_condition(self, condition, email):
+    def evaluate_date_condition(self, condition, email, now=None):
         """
         Evaluate date-based condition.
 
         Args:
-            condition: Condition dict with predicate and value
+            condition: CompiledCondition whose value is the age timedelta
             email: Email dict from database
+            now: Reference time, naive like the TIMESTAMP column (current time if omitted)
 
         Returns:
             bool: True if condition matches
         """
-        predicate = condition.get('predicate', '').lower()
-        value = condition.get('value', 0)
-        unit = condition.get('unit', 'days').lower()
-
         date_received = email.get('date_received')
         if not date_received:
             return False
 
-        # Ensure date_received is a datetime object
-        if isinstance(date_received, str):
-            try:
-                date_received = datetime.fromisoformat(date_received)
-            except:
-                return False
+        if now is None:
+            now = datetime.now()
 
-        # Calculate the threshold date
-        now = datetime.now(date_received.tzinfo) if date_received.tzinfo else datetime.now()
+        return OPS[condition.op](date_received, now - condition.value)
 
-        if unit == 'days':
-            threshold = now - timedelta(days=value)
-        elif unit == 'months':
-            threshold = now - timedelta(days=value * 30)  # Approximate
-        else:
-            print(f"Warning: Unknown unit '{unit}'")
-            return False
-
-        # Evaluate predicate
-        if predicate == 'less_than':
-            # Email is less than X days old (received after threshold)
-            return date_received > threshold
-        elif predicate == 'greater_than':
-            # Email is greater than X days old (received before threshold)
-            return date_received < threshold
-        else:
-            print(f"Warning: Unknown date predicate '{predicate}'")
-            return False
-
-    def evaluate_rule(self, rule, email):
+    def evaluate_rule(self, rule, email, fields=None, matched=None, now=None):
         """
         Evaluate all conditions in a rule against an email.
 
         Args:
-            rule: Rule dict with conditions and predicate
+            rule: CompiledRule from _compile_rules
             email: Email dict from database
+            fields: Lowercased fields from lowercase_fields (computed if omitted)
+            matched: Needle bitset from scan_email (computed if omitted)
+            now: Reference time for date conditions (current time if omitted)
 
         Returns:
             bool: True if rule matches
         """
-        predicate = rule.get('predicate', 'all').lower()
-        conditions = rule.get('conditions', [])
-
-        if not conditions:
+        if rule.match is None:
             return False
 
-        results = [self.evaluate_condition(cond, email) for cond in conditions]
+        if fields is None:
+            fields = self.lowercase_fields(email)
+        if matched is None:
+            matched = self.scan_email(fields)
 
-        if predicate == 'all':
-            return all(results)
-        elif predicate == 'any':
-            return any(results)
-        else:
-            print(f"Warning: Unknown rule predicate '{predicate}'")
-            return False
+        # Needle conditions for the whole rule are settled with two mask tests
+        if rule.match is all:
+            if matched & rule.required != rule.required or matched & rule.forbidden:
+                return False
+        elif matched & rule.required or rule.forbidden & ~matched:
+            return True
+
+        # Generator lets all()/any() stop at the first deciding condition
+        return rule.match(
+            self.evaluate_condition(cond, email, fields, matched, now) for cond in rule.checks
+        )
 
-    def execute_action(self, action, email):
+    def plan_action(self, action, email, current_labels=None):
         """
-        Execute a single action on an email.
+        Work out the label changes a single action makes to an email.
 
         Args:
             action: Action dict with type and parameters
             email: Email dict from database
+            current_labels: Labels the message will have after earlier queued
+                            changes (defaults to the stored labels)
 
         Returns:
-            bool: True if action succeeded
+            tuple: (add_labels, remove_labels) lists, or None if the action cannot run
         """
         action_type = action.get('type', '').lower()
-        gmail_message_id = email.get('gmail_message_id')
 
-        if not gmail_message_id:
-            print("✗ No gmail_message_id found for email")
-            return False
+        if action_type == 'mark_read' or action_type == 'mark_as_read':
+            return [], ['UNREAD']
 
-        try:
-            if action_type == 'mark_read' or action_type == 'mark_as_read':
-                return self.mark_as_read(gmail_message_id)
+        elif action_type == 'mark_unread' or action_type == 'mark_as_unread':
+            return ['UNREAD'], []
 
-            elif action_type == 'mark_unread' or action_type == 'mark_as_unread':
-                return self.mark_as_unread(gmail_message_id)
+        elif action_type == 'move':
+            mailbox = action.get('mailbox', 'INBOX')
+            if current_labels is None:
+                current_labels = email.get('labels')
+            return self.plan_move(current_labels, mailbox)
 
-            elif action_type == 'move':
-                mailbox = action.get('mailbox', 'INBOX')
-                return self.move_message(gmail_message_id, mailbox)
+        else:
+            logger.warning("Unknown action type '%s'", action_type)
+            return None
 
-            else:
-                print(f"Warning: Unknown action type '{action_type}'")
-                return False
+    @staticmethod
+    def plan_move(current_labels, mailbox):
+        """
+        Work out the label changes that move a message to a different mailbox/label.
 
-        except HttpError as e:
-            print(f"✗ Gmail API error: {e}")
-            return False
-        except Exception as e:
-            print(f"✗ Error executing action: {e}")
-            return False
+        Args:
+            current_labels: Labels the message has (or will have) before this move
+            mailbox: Target mailbox/label (INBOX, TRASH, etc.)
 
-    def mark_as_read(self, gmail_message_id):
-        """Mark email as read."""
-        try:
-            self.gmail_service.users().messages().modify(
-                userId='me',
-                id=gmail_message_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            print(f"  ✓ Marked as read: {gmail_message_id}")
-            return True
-        except Exception as e:
-            print(f"  ✗ Failed to mark as read: {e}")
-            return False
+        Returns:
+            tuple: (add_labels, remove_labels) lists
+        """
+        mailbox = mailbox.upper()
+
+        # Prepare label changes
+        add_labels = [mailbox]
+        remove_labels = []
+
+        # Remove conflicting labels
+        if mailbox in MOVE_CONFLICTS:
+            conflicts = MOVE_CONFLICTS[mailbox]
+            remove_labels = [l for l in current_labels or [] if l in conflicts]
 
-    def mark_as_unread(self, gmail_message_id):
-        """Mark email as unread."""
+        return add_labels, remove_labels
+
+    def _thread_http(self):
+        """
+        Get this thread's authorized HTTP connection.
+
+        httplib2 connections are not thread-safe, so each worker thread
+        executes its Gmail requests over its own.
+
+        Returns:
+            AuthorizedHttp
+        """
+        http = getattr(self._thread_state, 'http', None)
+        if http is None:
+            http = self._thread_state.http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return http
+
+    def _batch_modify(self, add_labels, remove_labels, messages):
+        """
+        Apply one label change to up to BATCH_MODIFY_LIMIT messages.
+
+        Args:
+            add_labels: Labels to add
+            remove_labels: Labels to remove
+            messages: List of (gmail_message_id, action_count) pairs
+
+        Returns:
+            int: Number of actions applied (0 on failure)
+        """
         try:
-            self.gmail_service.users().messages().modify(
+            self.gmail_service.users().messages().batchModify(
                 userId='me',
-                id=gmail_message_id,
-                body={'addLabelIds': ['UNREAD']}
-            ).execute()
-            print(f"  ✓ Marked as unread: {gmail_message_id}")
-            return True
+                body={
+                    'ids': [message_id for message_id, _ in messages],
+                    'addLabelIds': list(add_labels),
+                    'removeLabelIds': list(remove_labels)
+                }
+            ).execute(http=self._thread_http())
+            logger.info("  ✓ Updated %d emails (add: %s, remove: %s)",
+                        len(messages), list(add_labels), list(remove_labels))
+            return sum(count for _, count in messages)
+        except HttpError as e:
+            logger.error("  ✗ Gmail API error: %s", e)
         except Exception as e:
-            print(f"  ✗ Failed to mark as unread: {e}")
-            return False
+            logger.error("  ✗ Failed to update labels: %s", e)
+        return 0
 
-    def move_message(self, gmail_message_id, mailbox):
+    def apply_label_changes(self, pending):
         """
-        Move message to a different mailbox/label.
+        Apply queued label changes with one batchModify call per distinct change.
+
+        Calls for different changes run concurrently on ACTION_WORKERS threads.
 
         Args:
-            gmail_message_id: Gmail message ID
-            mailbox: Target mailbox/label (INBOX, TRASH, etc.)
+            pending: Dict mapping (add_labels, remove_labels) tuples to
+                     lists of (gmail_message_id, action_count) pairs
+
+        Returns:
+            int: Number of actions applied
         """
-        try:
-            # Get current labels
-            message = self.gmail_service.users().messages().get(
-                userId='me',
-                id=gmail_message_id,
-                format='minimal'
-            ).execute()
+        jobs = []
+        for (add_labels, remove_labels), messages in pending.items():
+            for start in range(0, len(messages), BATCH_MODIFY_LIMIT):
+                jobs.append((add_labels, remove_labels, messages[start:start + BATCH_MODIFY_LIMIT]))
 
-            current_labels = message.get('labelIds', [])
+        with ThreadPoolExecutor(max_workers=ACTION_WORKERS) as executor:
+            return sum(executor.map(lambda job: self._batch_modify(*job), jobs))
 
-            # Prepare label changes
-            add_labels = [mailbox.upper()]
-            remove_labels = []
+    @staticmethod
+    def _rule_to_sql(rule, now):
+        """
+        Translate a compiled rule into a SQL WHERE clause.
 
-            # Remove conflicting labels
-            if mailbox.upper() == 'TRASH':
-                remove_labels = [l for l in current_labels if l in ['INBOX', 'SPAM']]
-            elif mailbox.upper() == 'INBOX':
-                remove_labels = [l for l in current_labels if l in ['TRASH', 'SPAM']]
+        The clause selects a superset of the emails the rule matches; the
+        Python evaluator still runs on every returned row.
 
-            # Execute move
-            self.gmail_service.users().messages().modify(
-                userId='me',
-                id=gmail_message_id,
-                body={
-                    'addLabelIds': add_labels,
-                    'removeLabelIds': remove_labels
-                }
-            ).execute()
-            print(f"  ✓ Moved to {mailbox}: {gmail_message_id}")
-            return True
-        except Exception as e:
-            print(f"  ✗ Failed to move message: {e}")
-            return False
+        Args:
+            rule: CompiledRule from _compile_rules
+            now: Reference time for date conditions
+
+        Returns:
+            tuple: (where_clause, params)
+        """
+        if rule.match is None or not rule.conditions:
+            return 'FALSE', []
+
+        clauses = []
+        params = []
+
+        for condition in rule.conditions:
+            if condition.field == 'body':
+                # Body matching runs on HTML-stripped text, which SQL can't reproduce
+                clauses.append('TRUE')
+            elif condition.field == 'date_received':
+                comparison = '>' if condition.op == Op.LESS_THAN else '<'
+                clauses.append(f"date_received {comparison} %s")
+                params.append(now - condition.value)
+            else:
+                clauses.append(f"lower({FIELD_COLUMNS[condition.field]}) {SQL_OPS[condition.op]} %s")
+                if condition.op in (Op.CONTAINS, Op.NOT_CONTAINS):
+                    escaped = (condition.value.replace('\\', '\\\\')
+                               .replace('%', '\\%').replace('_', '\\_'))
+                    params.append(f"%{escaped}%")
+                else:
+                    params.append(condition.value)
+
+        joiner = ' AND ' if rule.match is all else ' OR '
+        return '(' + joiner.join(clauses) + ')', params
+
+    def _fields_needed(self):
+        """
+        Collect the fields referenced by any compiled rule condition.
+
+        Returns:
+            set: Canonical field names
+        """
+        return {
+            condition.field
+            for rule in self.compiled_rules
+            for condition in rule.conditions
+        }
 
-    def get_emails_from_db(self, limit=100):
+    def _select_columns(self):
         """
-        Fetch emails from database for processing.
+        Work out which email columns the compiled rules actually read.
+
+        Returns:
+            list: Column names for the SELECT list
+        """
+        fields_needed = self._fields_needed()
+        columns = list(BASE_COLUMNS)
+        for field, field_columns in FIELD_SELECT_COLUMNS.items():
+            if field in fields_needed:
+                columns.extend(field_columns)
+        return columns
+
+    def get_emails_from_db(self, limit=100, now=None):
+        """
+        Stream emails that could match at least one rule from database for processing.
+
+        Rows are read through a server-side cursor EMAIL_FETCH_SIZE at a time,
+        so only one chunk of email bodies is held in memory.
 
         Args:
             limit: Maximum number of emails to fetch
+            now: Reference time for date conditions (current time if omitted)
 
-        Returns:
-            list: List of email dicts
+        Yields:
+            dict: Email row
         """
+        # Push rule conditions into the query so non-matching rows never leave Postgres
+        if now is None:
+            now = datetime.now()
+        clauses = []
+        params = []
+        for rule in self.compiled_rules:
+            clause, rule_params = self._rule_to_sql(rule, now)
+            clauses.append(clause)
+            params.extend(rule_params)
+        where = ' OR '.join(clauses) or 'FALSE'
+
+        # Server-side cursors only live inside a transaction
+        self.db_conn.autocommit = False
+
+        # Plain tuple rows zipped into dicts decode about twice as fast as RealDictCursor
+        cursor = self.db_conn.cursor(name='emails_stream')
+        cursor.itersize = EMAIL_FETCH_SIZE
+        columns = self._select_columns()
+        fetched = 0
+
         try:
-            cursor = self.db_conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT
-                    id, gmail_message_id, thread_id, subject, sender,
-                    recipient, cc, bcc, date_received, snippet,
-                    body_text, body_html, labels, is_read, is_starred
+            # Large body columns are only shipped when a rule inspects them
+            cursor.execute(f"""
+                SELECT {', '.join(columns)}
                 FROM emails
+                WHERE {where}
                 ORDER BY date_received DESC
                 LIMIT %s
-            """, (limit,))
+            """, (*params, limit))
+
+            for row in cursor:
+                fetched += 1
+                yield dict(zip(columns, row))
 
-            emails = cursor.fetchall()
             cursor.close()
-            print(f"✓ Fetched {len(emails)} emails from database")
-            return emails
+            self.db_conn.commit()
+            logger.info("✓ Fetched %d emails from database", fetched)
 
         except Exception as e:
-            print(f"✗ Error fetching emails: {e}")
-            return []
+            # Rolling back also discards the server-side cursor
+            self.db_conn.rollback()
+            logger.error("✗ Error fetching emails: %s", e)
+
+        finally:
+            # Closed early (e.g. GeneratorExit): end the open transaction first,
+            # since autocommit can't be switched inside one
+            if self.db_conn.status != psycopg2.extensions.STATUS_READY:
+                self.db_conn.rollback()
+            self.db_conn.autocommit = True
+
+    def _evaluate_email(self, email, now):
+        """
+        Evaluate every rule against one email and plan its label changes.
+
+        Only reads shared state, so it can run on worker threads.
+
+        Args:
+            email: Email dict from database
+            now: Reference time for date conditions
+
+        Returns:
+            tuple: (rule_matched, label_key, action_count) where label_key is the
+                   (add_labels, remove_labels) pair of sorted tuples
+        """
+        email_id = email.get('gmail_message_id', 'unknown')
+        subject = email.get('subject', 'No Subject')[:60]
+        sender = email.get('sender', 'Unknown')[:40]
+
+        # Lowercase once, then one pass per field finds every needle for all rules
+        fields = self.lowercase_fields(email)
+        matched = self.scan_email(fields)
+
+        # Net label changes across every matching rule, in rule order
+        stored_labels = set(email.get('labels') or [])
+        add_labels = set()
+        remove_labels = set()
+        action_count = 0
+        rule_matched = False
+
+        # Check each rule
+        for rule in self.compiled_rules:
+            # Evaluate rule
+            if self.evaluate_rule(rule, email, fields, matched, now):
+                rule_matched = True
+                logger.debug("✓ Rule matched: '%s'\n  Email: %s\n  From: %s",
+                             rule.description, subject, sender)
+
+                if not email.get('gmail_message_id'):
+                    logger.error("✗ No gmail_message_id found for email")
+                    continue
+
+                # Queue actions
+                for action in rule.actions:
+                    # Plan against the labels as they stand after the changes queued so far
+                    current_labels = (stored_labels | add_labels) - remove_labels
+                    changes = self.plan_action(action, email, current_labels)
+                    if changes is None:
+                        continue
+                    add, remove = changes
+                    add_labels = (add_labels - set(remove)) | set(add)
+                    remove_labels = (remove_labels - set(add)) | set(remove)
+                    action_count += 1
+                    logger.debug("  • Queued %s: %s", action.get('type'), email_id)
+
+        label_key = (tuple(sorted(add_labels)), tuple(sorted(remove_labels)))
+        return rule_matched, label_key, action_count
 
     def process_emails(self, limit=100):
         """
@@ -398,61 +976,71 @@ class EmailRuleProcessor:
             limit: Maximum number of emails to process
         """
         if not self.rules:
-            print("No rules to process")
+            logger.info("No rules to process")
             return
 
-        print(f"\n{'='*80}")
-        print(f"Processing emails with {len(self.rules)} rules")
-        print(f"{'='*80}\n")
+        logger.info("Processing emails with %d rules", len(self.rules))
 
         # Authenticate Gmail
         self.authenticate_gmail()
 
-        # Get emails
-        emails = self.get_emails_from_db(limit)
+        # Label changes queued per (add_labels, remove_labels), applied in batches
+        pending = {}
+        emails_processed = 0
+        emails_matched = 0
 
-        if not emails:
-            print("No emails to process")
-            return
-
-        # Process each email
-        total_actions = 0
-
-        for email in emails:
-            email_id = email.get('gmail_message_id', 'unknown')
-            subject = email.get('subject', 'No Subject')[:60]
-            sender = email.get('sender', 'Unknown')[:40]
+        # One reference time for the whole batch, shared with the SQL prefilter
+        now = datetime.now()
+        evaluate = partial(self._evaluate_email, now=now)
 
-            # Check each rule
-            for rule_idx, rule in enumerate(self.rules, 1):
-                rule_desc = rule.get('description', f'Rule {rule_idx}')
+        # Emails are streamed from the database and evaluated a fetch-chunk at a
+        # time on worker threads, so memory stays bounded by EMAIL_FETCH_SIZE
+        emails = self.get_emails_from_db(limit, now)
+        try:
+            with ThreadPoolExecutor(max_workers=EVALUATION_WORKERS) as executor:
+                while True:
+                    chunk = list(islice(emails, EMAIL_FETCH_SIZE))
+                    if not chunk:
+                        break
+                    emails_processed += len(chunk)
+
+                    for email, (rule_matched, label_key, action_count) in zip(chunk, executor.map(evaluate, chunk)):
+                        emails_matched += rule_matched
+                        if action_count:
+                            pending.setdefault(label_key, []).append((email['gmail_message_id'], action_count))
+        finally:
+            # Release the server-side cursor and transaction even if evaluation fails
+            emails.close()
+
+        if not emails_processed:
+            logger.info("No emails to process")
+            return
 
-                # Evaluate rule
-                if self.evaluate_rule(rule, email):
-                    print(f"\n✓ Rule matched: '{rule_desc}'")
-                    print(f"  Email: {subject}")
-                    print(f"  From: {sender}")
-                    print(f"  Actions:")
+        # One summary line per batch instead of per email
+        logger.info("✓ %d of %d emails matched at least one rule",
+                    emails_matched, emails_processed)
 
-                    # Execute actions
-                    actions = rule.get('actions', [])
-                    for action in actions:
-                        if self.execute_action(action, email):
-                            total_actions += 1
+        # Execute actions
+        logger.info("Applying label changes...")
+        total_actions = self.apply_label_changes(pending)
 
-        print(f"\n{'='*80}")
-        print(f"Processing complete: {total_actions} actions executed")
-        print(f"{'='*80}\n")
+        logger.info("Processing complete: %d actions executed", total_actions)
 
     def close(self):
         """Close database connection."""
         if self.db_conn:
             self.db_conn.close()
-            print("✓ Database connection closed")
+            logger.info("✓ Database connection closed")
 
 
 def main():
     """Main function."""
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(message)s',
+        stream=sys.stdout
+    )
+
     print("="*80)
     print("Email Rule Processor")
     print("="*80)
@@ -466,7 +1054,7 @@ def main():
         processor.process_emails(limit=100)
 
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
     finally:
         processor.close()
 
@@ -5,38 +5,149 @@ Authenticates using OAuth 2.0, fetches emails from Gmail inbox, and stores them
 """
 
 import os
-import json
+import re
+import sys
+import time
+import queue
+import random
+import imaplib
+import logging
+import binascii
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from email import message_from_bytes, policy
 from email.utils import parsedate_to_datetime
+from logging.handlers import QueueHandler, QueueListener
+import httplib2
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Gmail API scopes
 # Use gmail.modify to allow marking as read/unread and moving messages
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Sub-requests per batch HTTP request; Gmail accepts 100 but starts
+# rate-limiting batches larger than 50
+BATCH_SIZE = 50
+
+# Batch requests kept in flight at once when a fetch spans several batches
+FETCH_WORKERS = 2
+
+# Retry rounds for sub-requests that were rate-limited, hit a server error
+# or were lost to a transport error, and the delay (seconds) before the
+# first round; it doubles each round
+FETCH_RETRIES = 5
+FETCH_BACKOFF = 1.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RATE_LIMIT_REASONS = frozenset({'rateLimitExceeded', 'userRateLimitExceeded'})
+
+# History records requested per history.list page (Gmail's maximum)
+HISTORY_PAGE_SIZE = 500
+
+# IMAP backfill: Gmail only accepts XOAUTH2 tokens carrying the full mail scope
+IMAP_HOST = 'imap.gmail.com'
+IMAP_SCOPE = 'https://mail.google.com/'
+
+# Messages per IMAP FETCH, and the most message bytes (by RFC822.SIZE) one
+# FETCH may hold in memory; a larger single message is fetched on its own
+IMAP_FETCH_SIZE = 100
+IMAP_FETCH_BYTES = 25 * 1024 * 1024
+
+# Gmail IMAP system labels and flags mapped to API label IDs
+IMAP_SYSTEM_LABELS = {
+    '\\Important': 'IMPORTANT',
+    '\\Sent': 'SENT',
+    '\\Draft': 'DRAFT',
+    '\\Starred': 'STARRED',
+}
+IMAP_FETCH_ITEM = re.compile(rb'(UID|RFC822\.SIZE|X-GM-MSGID|X-GM-THRID) (\d+)|(FLAGS|X-GM-LABELS) \(([^)]*)\)')
+
+# Headers stored for each email; metadata fetches ask Gmail for only these
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Cc', 'Bcc', 'Date']
+STORED_HEADERS = frozenset(name.lower() for name in METADATA_HEADERS)
+
+# Credentials already loaded in this process, keyed by user email
+_CREDS_CACHE = {}
+
+# Built Gmail services keyed by user email; each keeps its HTTP connection
+# open between requests
+_SERVICE_CACHE = {}
+
+# Shared token-endpoint transport; its HTTP session keeps connections alive
+_AUTH_REQUEST = Request()
+
+# Rows per multi-VALUES INSERT statement in bulk saves
+INSERT_PAGE_SIZE = 500
+
+# Database connections kept open / allowed at once by DatabaseManager's pool
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 10
+
+
+# Outcome of batch_get_messages: fetched messages plus the IDs that Gmail
+# reported as deleted (404) and the IDs that could not be fetched
+FetchResult = namedtuple('FetchResult', ['messages', 'gone', 'failed'])
+
+# Outcome of store_messages: IDs saved to the database, deleted (404) and
+# not stored because their fetch or the save failed
+StoreResult = namedtuple('StoreResult', ['stored', 'gone', 'failed'])
+
+
+class OrjsonModel(JsonModel):
+    """JsonModel that decodes API responses with orjson instead of json."""
+
+    def deserialize(self, content):
+        """
+        Decode a response body.
+
+        Args:
+            content: Response body (bytes or str)
+
+        Returns:
+            Decoded JSON, or the body as text if it isn't JSON
+        """
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return content.decode('utf-8') if isinstance(content, bytes) else content
+
+        if self._data_wrapper and 'data' in body:
+            body = body['data']
+        return body
+
 
 class DatabaseManager:
     """Manages PostgreSQL database connections and operations."""
 
     def __init__(self):
-        """Initialize database connection."""
-        self.conn = None
+        """Initialize database connection pool."""
+        self.pool = None
         self.connect()
 
     def connect(self):
-        """Establish connection to PostgreSQL database."""
+        """Open a pool of PostgreSQL database connections."""
         try:
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                DB_POOL_MIN_CONNECTIONS,
+                DB_POOL_MAX_CONNECTIONS,
                 host=os.getenv('DB_HOST'),
                 port=os.getenv('DB_PORT', 5432),
                 database=os.getenv('DB_NAME'),
@@ -44,16 +155,41 @@ class DatabaseManager:
                 password=os.getenv('DB_PASSWORD'),
                 sslmode=os.getenv('DB_SSLMODE', 'require')
             )
-            print("Successfully connected to PostgreSQL database")
+            logger.info("Successfully connected to PostgreSQL database")
         except Exception as e:
-            print(f"Error connecting to database: {e}")
+            logger.error("Error connecting to database: %s", e)
             raise
 
     def close(self):
-        """Close database connection."""
-        if self.conn:
-            self.conn.close()
-            print("Database connection closed")
+        """Close all pooled database connections."""
+        if self.pool:
+            self.pool.closeall()
+            logger.info("Database connection closed")
+
+    @contextmanager
+    def cursor(self, **kwargs):
+        """
+        Check out a pooled connection and yield a cursor on it.
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises; either way the connection returns to the pool.
+
+        Args:
+            **kwargs: Passed to connection.cursor() (e.g. cursor_factory)
+
+        Yields:
+            cursor: psycopg2 cursor
+        """
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor(**kwargs) as cursor:
+                yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
 
     def save_token(self, user_email, creds):
         """
@@ -64,46 +200,41 @@ class DatabaseManager:
             creds: Google OAuth credentials object
         """
         try:
-            cursor = self.conn.cursor()
-
-            # Convert credentials to dictionary
-            token_data = {
-                'token': creds.token,
-                'refresh_token': creds.refresh_token,
-                'token_uri': creds.token_uri,
-                'client_id': creds.client_id,
-                'client_secret': creds.client_secret,
-                'scopes': json.dumps(creds.scopes) if creds.scopes else None,
-                'expiry': creds.expiry
-            }
-
-            # Insert or update token
-            cursor.execute("""
-                INSERT INTO oauth_tokens (user_email, token, refresh_token, token_uri,
-                                         client_id, client_secret, scopes, expiry)
-                VALUES (%(user_email)s, %(token)s, %(refresh_token)s, %(token_uri)s,
-                       %(client_id)s, %(client_secret)s, %(scopes)s, %(expiry)s)
-                ON CONFLICT (user_email)
-                DO UPDATE SET
-                    token = EXCLUDED.token,
-                    refresh_token = EXCLUDED.refresh_token,
-                    token_uri = EXCLUDED.token_uri,
-                    client_id = EXCLUDED.client_id,
-                    client_secret = EXCLUDED.client_secret,
-                    scopes = EXCLUDED.scopes,
-                    expiry = EXCLUDED.expiry,
-                    updated_at = CURRENT_TIMESTAMP
-            """, {'user_email': user_email, **token_data})
-
-            self.conn.commit()
-            print(f"Token saved to database for {user_email}")
+            with self.cursor() as cursor:
+                # Convert credentials to dictionary
+                token_data = {
+                    'token': creds.token,
+                    'refresh_token': creds.refresh_token,
+                    'token_uri': creds.token_uri,
+                    'client_id': creds.client_id,
+                    'client_secret': creds.client_secret,
+                    'scopes': orjson.dumps(creds.scopes).decode() if creds.scopes else None,
+                    'expiry': creds.expiry
+                }
+
+                # Insert or update token
+                cursor.execute("""
+                    INSERT INTO oauth_tokens (user_email, token, refresh_token, token_uri,
+                                             client_id, client_secret, scopes, expiry)
+                    VALUES (%(user_email)s, %(token)s, %(refresh_token)s, %(token_uri)s,
+                           %(client_id)s, %(client_secret)s, %(scopes)s, %(expiry)s)
+                    ON CONFLICT (user_email)
+                    DO UPDATE SET
+                        token = EXCLUDED.token,
+                        refresh_token = EXCLUDED.refresh_token,
+                        token_uri = EXCLUDED.token_uri,
+                        client_id = EXCLUDED.client_id,
+                        client_secret = EXCLUDED.client_secret,
+                        scopes = EXCLUDED.scopes,
+                        expiry = EXCLUDED.expiry,
+                        updated_at = CURRENT_TIMESTAMP
+                """, {'user_email': user_email, **token_data})
+
+            logger.info("Token saved to database for %s", user_email)
 
         except Exception as e:
-            self.conn.rollback()
-            print(f"Error saving token: {e}")
+            logger.error("Error saving token: %s", e)
             raise
-        finally:
-            cursor.close()
 
     def get_token(self, user_email):
         """
@@ -116,16 +247,15 @@ class DatabaseManager:
             Credentials object or None
         """
         try:
-            cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT token, refresh_token, token_uri, client_id,
-                       client_secret, scopes, expiry
-                FROM oauth_tokens
-                WHERE user_email = %s
-            """, (user_email,))
+            with self.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT token, refresh_token, token_uri, client_id,
+                           client_secret, scopes, expiry
+                    FROM oauth_tokens
+                    WHERE user_email = %s
+                """, (user_email,))
 
-            result = cursor.fetchone()
-            cursor.close()
+                result = cursor.fetchone()
 
             if result:
                 # Reconstruct credentials object
@@ -135,7 +265,7 @@ class DatabaseManager:
                     token_uri=result['token_uri'],
                     client_id=result['client_id'],
                     client_secret=result['client_secret'],
-                    scopes=json.loads(result['scopes']) if result['scopes'] else None
+                    scopes=orjson.loads(result['scopes']) if result['scopes'] else None
                 )
                 # Set expiry if it exists
                 if result['expiry']:
@@ -146,43 +276,164 @@ class DatabaseManager:
             return None
 
         except Exception as e:
-            print(f"Error retrieving token: {e}")
+            logger.error("Error retrieving token: %s", e)
             return None
 
-    def save_email(self, email_data):
+    def save_emails_bulk(self, email_list):
         """
-        Save email to database.
+        Save many emails to database in one transaction.
+
+        Rows are sent as multi-VALUES INSERTs of up to INSERT_PAGE_SIZE rows.
 
         Args:
-            email_data: Dictionary containing email information
+            email_list: List of email data dictionaries (as from parse_message)
+
+        Returns:
+            int: Number of emails saved (0 if the transaction failed)
         """
+        # One upsert can't touch the same row twice, so keep the last copy of each message
+        rows = list({email['gmail_message_id']: email for email in email_list}.values())
+        if not rows:
+            return 0
+
         try:
-            cursor = self.conn.cursor()
-
-            cursor.execute("""
-                INSERT INTO emails (gmail_message_id, thread_id, subject, sender,
-                                   recipient, cc, bcc, date_received, snippet,
-                                   body_text, body_html, labels, is_read, is_starred)
-                VALUES (%(gmail_message_id)s, %(thread_id)s, %(subject)s, %(sender)s,
-                       %(recipient)s, %(cc)s, %(bcc)s, %(date_received)s, %(snippet)s,
-                       %(body_text)s, %(body_html)s, %(labels)s, %(is_read)s, %(is_starred)s)
-                ON CONFLICT (gmail_message_id)
-                DO UPDATE SET
-                    subject = EXCLUDED.subject,
-                    snippet = EXCLUDED.snippet,
-                    labels = EXCLUDED.labels,
-                    is_read = EXCLUDED.is_read,
-                    is_starred = EXCLUDED.is_starred,
-                    updated_at = CURRENT_TIMESTAMP
-            """, email_data)
-
-            self.conn.commit()
+            with self.cursor() as cursor:
+                execute_values(cursor, """
+                    INSERT INTO emails (gmail_message_id, thread_id, subject, sender,
+                                       recipient, cc, bcc, date_received, snippet,
+                                       body_text, body_html, labels, is_read, is_starred)
+                    VALUES %s
+                    ON CONFLICT (gmail_message_id)
+                    DO UPDATE SET
+                        subject = EXCLUDED.subject,
+                        snippet = EXCLUDED.snippet,
+                        labels = EXCLUDED.labels,
+                        is_read = EXCLUDED.is_read,
+                        is_starred = EXCLUDED.is_starred,
+                        updated_at = CURRENT_TIMESTAMP
+                    -- Leave unchanged rows alone so re-fetches don't rewrite them
+                    WHERE (emails.subject, emails.snippet, emails.labels, emails.is_read, emails.is_starred)
+                          IS DISTINCT FROM
+                          (EXCLUDED.subject, EXCLUDED.snippet, EXCLUDED.labels, EXCLUDED.is_read, EXCLUDED.is_starred)
+                """, rows, template="""
+                    (%(gmail_message_id)s, %(thread_id)s, %(subject)s, %(sender)s,
+                     %(recipient)s, %(cc)s, %(bcc)s, %(date_received)s, %(snippet)s,
+                     %(body_text)s, %(body_html)s, %(labels)s::text[], %(is_read)s, %(is_starred)s)
+                """, page_size=INSERT_PAGE_SIZE)
+
+            return len(rows)
 
         except Exception as e:
-            self.conn.rollback()
-            print(f"Error saving email {email_data.get('gmail_message_id')}: {e}")
-        finally:
-            cursor.close()
+            logger.error("Error saving %d emails: %s", len(rows), e)
+            return 0
+
+    def get_stored_ids(self, message_ids):
+        """
+        Find which of the given messages are already stored.
+
+        Args:
+            message_ids: List of Gmail message IDs
+
+        Returns:
+            set: IDs already in the emails table (empty on error)
+        """
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT gmail_message_id
+                    FROM emails
+                    WHERE gmail_message_id = ANY(%s)
+                """, (message_ids,))
+
+                return {row[0] for row in cursor.fetchall()}
+
+        except Exception as e:
+            logger.error("Error checking stored emails: %s", e)
+            return set()
+
+    def update_labels(self, label_changes):
+        """
+        Overwrite the labels and read/starred flags of stored emails.
+
+        Messages that aren't stored are ignored.
+
+        Args:
+            label_changes: Dict mapping gmail_message_id to its current label IDs
+
+        Returns:
+            bool: True if the update succeeded
+        """
+        if not label_changes:
+            return True
+
+        rows = [(message_id, labels_literal(labels)) for message_id, labels in label_changes.items()]
+
+        try:
+            with self.cursor() as cursor:
+                execute_values(cursor, """
+                    UPDATE emails
+                    SET labels = changes.labels,
+                        is_read = NOT ('UNREAD' = ANY(changes.labels)),
+                        is_starred = 'STARRED' = ANY(changes.labels),
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS changes (gmail_message_id, labels)
+                    WHERE emails.gmail_message_id = changes.gmail_message_id
+                      AND emails.labels IS DISTINCT FROM changes.labels
+                """, rows, template="(%s, %s::text[])", page_size=INSERT_PAGE_SIZE)
+
+            return True
+
+        except Exception as e:
+            logger.error("Error updating labels: %s", e)
+            return False
+
+    def get_history_id(self, user_email):
+        """
+        Retrieve the Gmail historyId reached by the last sync.
+
+        Args:
+            user_email: User's email address
+
+        Returns:
+            int or None
+        """
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT last_history_id
+                    FROM sync_state
+                    WHERE user_email = %s
+                """, (user_email,))
+
+                result = cursor.fetchone()
+
+            return result[0] if result else None
+
+        except Exception as e:
+            logger.error("Error retrieving sync state: %s", e)
+            return None
+
+    def save_history_id(self, user_email, history_id):
+        """
+        Save the Gmail historyId reached by a sync.
+
+        Args:
+            user_email: User's email address
+            history_id: Gmail historyId
+        """
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO sync_state (user_email, last_history_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (user_email)
+                    DO UPDATE SET
+                        last_history_id = EXCLUDED.last_history_id,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (user_email, int(history_id)))
+
+        except Exception as e:
+            logger.error("Error saving sync state: %s", e)
 
 
 def authenticate_gmail(db_manager, user_email):
@@ -197,20 +448,26 @@ def authenticate_gmail(db_manager, user_email):
     Returns:
         service: Authorized Gmail API service instance
     """
-    creds = None
+    # Reuse the service built earlier in this process while its token is good
+    service = _SERVICE_CACHE.get(user_email)
+    if service is not None and _CREDS_CACHE[user_email].valid:
+        return service
 
-    # Try to get credentials from database
-    creds = db_manager.get_token(user_email)
+    # Try credentials loaded earlier in this process, then the database
+    creds = _CREDS_CACHE.get(user_email) or db_manager.get_token(user_email)
 
-    # If there are no (valid) credentials available, let the user log in
+    # If there are no (valid) credentials available, let the user log in.
+    # creds.expired already reports expiry a few minutes early.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            print("Refreshing expired token...")
+            logger.info("Refreshing expired token...")
             try:
-                creds.refresh(Request())
-                db_manager.save_token(user_email, creds)
+                old_token = creds.token
+                creds.refresh(_AUTH_REQUEST)
+                if creds.token != old_token:
+                    db_manager.save_token(user_email, creds)
             except Exception as e:
-                print(f"Error refreshing token: {e}")
+                logger.error("Error refreshing token: %s", e)
                 creds = None
 
         if not creds:
@@ -219,7 +476,7 @@ def authenticate_gmail(db_manager, user_email):
                     "credentials.json not found. Please download it from Google Cloud Console."
                 )
 
-            print("Starting OAuth authentication flow...")
+            logger.info("Starting OAuth authentication flow...")
             flow = InstalledAppFlow.from_client_secrets_file(
                 'credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
@@ -227,12 +484,15 @@ def authenticate_gmail(db_manager, user_email):
             # Save the credentials to database
             db_manager.save_token(user_email, creds)
 
+    _CREDS_CACHE[user_email] = creds
+
     try:
-        service = build('gmail', 'v1', credentials=creds)
-        print("Successfully authenticated to Gmail API")
+        service = build('gmail', 'v1', credentials=creds, model=OrjsonModel())
+        _SERVICE_CACHE[user_email] = service
+        logger.info("Successfully authenticated to Gmail API")
         return service
     except HttpError as error:
-        print(f"An error occurred: {error}")
+        logger.error("An error occurred: %s", error)
         return None
 
 
@@ -252,10 +512,29 @@ def parse_email_date(date_string):
         return None
 
 
+def b64decode(data):
+    """
+    Decode Gmail's URL-safe base64.
+
+    Calls binascii directly, skipping the str.translate and validation
+    layers of base64.urlsafe_b64decode.
+
+    Args:
+        data: URL-safe base64 string
+
+    Returns:
+        bytes
+    """
+    return binascii.a2b_base64(data.replace('-', '+').replace('_', '/') + '=' * (-len(data) % 4))
+
+
 def get_email_body(payload):
     """
     Extract email body from message payload.
 
+    Walks nested parts depth-first (e.g. multipart/alternative inside
+    multipart/mixed) and keeps the first text/plain and text/html bodies.
+
     Args:
         payload: Email message payload
 
@@ -265,38 +544,325 @@ def get_email_body(payload):
     text_body = None
     html_body = None
 
-    if 'parts' in payload:
-        for part in payload['parts']:
+    stack = [payload]
+    while stack and (text_body is None or html_body is None):
+        part = stack.pop()
+        data = (part.get('body') or {}).get('data')
+
+        # Named parts are attachments
+        if data and not part.get('filename'):
             mime_type = part.get('mimeType', '')
-            if mime_type == 'text/plain' and 'data' in part.get('body', {}):
-                import base64
-                text_body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-            elif mime_type == 'text/html' and 'data' in part.get('body', {}):
-                import base64
-                html_body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-    elif 'body' in payload and 'data' in payload['body']:
-        import base64
-        data = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
-        mime_type = payload.get('mimeType', '')
-        if mime_type == 'text/plain':
-            text_body = data
-        elif mime_type == 'text/html':
-            html_body = data
+            if mime_type == 'text/plain' and text_body is None:
+                text_body = b64decode(data).decode('utf-8', errors='ignore')
+            elif mime_type == 'text/html' and html_body is None:
+                html_body = b64decode(data).decode('utf-8', errors='ignore')
+
+        # Reversed so parts are visited in document order
+        if 'parts' in part:
+            stack.extend(reversed(part['parts']))
 
     return text_body, html_body
 
 
-def fetch_and_store_emails(service, db_manager, max_results=10):
+def get_mime_body(mime):
     """
-    Fetches emails from the user's inbox and stores them in the database.
+    Extract email body from a parsed RFC 822 message.
+
+    Args:
+        mime: email.message.EmailMessage
+
+    Returns:
+        tuple: (text_body, html_body)
+    """
+    bodies = {'text/plain': None, 'text/html': None}
+
+    for part in mime.walk():
+        content_type = part.get_content_type()
+        if (content_type not in bodies or bodies[content_type] is not None
+                or part.get_content_disposition() == 'attachment'):
+            continue
+
+        data = part.get_payload(decode=True) or b''
+        try:
+            bodies[content_type] = data.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+        except LookupError:
+            # Unknown charset label
+            bodies[content_type] = data.decode('utf-8', errors='ignore')
+
+    return bodies['text/plain'], bodies['text/html']
+
+
+def labels_literal(labels):
+    """
+    Format label IDs as a PostgreSQL text[] literal.
+
+    psycopg2 adapts a plain string about three times faster than a list,
+    which it walks and renders as ARRAY[...] on every row.
+
+    Args:
+        labels: List of Gmail label IDs
+
+    Returns:
+        str: Array literal such as '{"INBOX","UNREAD"}'
+    """
+    return '{' + ','.join('"' + label.replace('\\', '\\\\').replace('"', '\\"') + '"' for label in labels) + '}'
+
+
+def parse_message(message):
+    """
+    Convert a Gmail message resource into an emails table row.
+
+    Args:
+        message: Message resource fetched with format='raw', 'full' or 'metadata'
+                 (metadata messages have no body). 'raw' may also hold the
+                 already-decoded RFC 822 bytes, as fetched over IMAP.
+
+    Returns:
+        dict: Email data keyed by emails table column
+    """
+    if 'raw' in message:
+        # Parse the RFC 822 source locally instead of walking Gmail's part tree
+        raw = message['raw']
+        mime = message_from_bytes(b64decode(raw) if isinstance(raw, str) else raw, policy=policy.default)
+        hmap = {name.lower(): str(mime[name]) for name in METADATA_HEADERS if name in mime}
+        text_body, html_body = get_mime_body(mime)
+    else:
+        # Extract headers in one pass (first occurrence wins), stopping once all are found
+        hmap = {}
+        for header in message['payload']['headers']:
+            name = header['name'].lower()
+            if name in STORED_HEADERS and name not in hmap:
+                hmap[name] = header['value']
+                if len(hmap) == len(STORED_HEADERS):
+                    break
+        text_body, html_body = get_email_body(message['payload'])
+
+    date_str = hmap.get('date')
+
+    # Extract labels and flags
+    labels = message.get('labelIds', [])
+
+    return {
+        'gmail_message_id': message['id'],
+        'thread_id': message.get('threadId'),
+        'subject': hmap.get('subject', 'No Subject'),
+        'sender': hmap.get('from', 'Unknown Sender'),
+        'recipient': hmap.get('to', ''),
+        'cc': hmap.get('cc'),
+        'bcc': hmap.get('bcc'),
+        'date_received': parse_email_date(date_str) if date_str else None,
+        'snippet': message.get('snippet', ''),
+        'body_text': text_body,
+        'body_html': html_body,
+        'labels': labels_literal(labels),
+        'is_read': 'UNREAD' not in labels,
+        'is_starred': 'STARRED' in labels
+    }
+
+
+def is_retryable(error):
+    """
+    Check whether a failed request is worth retrying.
+
+    Args:
+        error: Exception raised for the request
+
+    Returns:
+        bool: True for rate limits, server errors and transport errors
+    """
+    if isinstance(error, HttpError):
+        # BatchError (an HttpError) may have no resp and never sets error_details
+        status = getattr(error.resp, 'status', None)
+        if status in RETRY_STATUSES:
+            return True
+        # Gmail reports some rate limits as 403 rather than 429
+        details = getattr(error, 'error_details', None)
+        if not isinstance(details, list):
+            details = []
+        return status == 403 and any(
+            isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS
+            for detail in details
+        )
+    return isinstance(error, (httplib2.HttpLib2Error, OSError))
+
+
+def batch_get_messages(service, message_ids, message_format='full', metadata_headers=None, parse=None,
+                       credentials=None):
+    """
+    Fetch many messages using batch HTTP requests of up to BATCH_SIZE each.
+
+    When credentials are given and there is more than one batch, up to
+    FETCH_WORKERS of them are sent concurrently, each thread over its own
+    HTTP connection. Sub-requests that fail with a retryable error (see
+    is_retryable) are sent again, up to FETCH_RETRIES rounds with
+    exponential backoff.
+
+    Args:
+        service: Authorized Gmail API service instance
+        message_ids: List of Gmail message IDs
+        message_format: Message format to request (default: 'full')
+        metadata_headers: Headers to return when message_format is 'metadata'
+        parse: Optional function applied to each message as its response
+               arrives, so the raw resource can be dropped right away
+        credentials: Credentials the service was built with; needed to
+                     authorize the extra connections of concurrent batches
+                     (default: None, send batches one at a time)
+
+    Returns:
+        FetchResult: Messages (or parsed results) in the order of
+                     message_ids, plus the IDs that no longer exist and
+                     the IDs that failed
+    """
+    fetched = {}
+    gone = set()
+    failed = set()
+    retry = []
+
+    def on_message(request_id, response, exception):
+        if exception is None:
+            try:
+                fetched[request_id] = parse(response) if parse else response
+            except Exception as e:
+                logger.error("Error processing message %s: %s", request_id, e)
+                failed.add(request_id)
+        elif isinstance(exception, HttpError) and getattr(exception.resp, 'status', None) == 404:
+            gone.add(request_id)
+        elif is_retryable(exception):
+            retry.append(request_id)
+        else:
+            logger.error("Error fetching message %s: %s", request_id, exception)
+            failed.add(request_id)
+
+    params = {'format': message_format}
+    if metadata_headers:
+        params['metadataHeaders'] = metadata_headers
+
+    def execute(batch_ids, http=None):
+        batch = service.new_batch_http_request(callback=on_message)
+        for message_id in batch_ids:
+            batch.add(
+                service.users().messages().get(userId='me', id=message_id, **params),
+                request_id=message_id
+            )
+        try:
+            batch.execute(http=http)
+            return True
+        except Exception as e:
+            # Callbacks only run once the whole batch response is in, so none
+            # of its messages were handled
+            if is_retryable(e):
+                logger.warning("Batch of %d messages failed, will retry: %s", len(batch_ids), e)
+                retry.extend(batch_ids)
+            else:
+                logger.error("Batch of %d messages failed: %s", len(batch_ids), e)
+                failed.update(batch_ids)
+            return False
+
+    # httplib2 connections aren't thread-safe, so concurrent batches need
+    # their own, authorized with the service's credentials
+    local = threading.local()
+
+    def execute_threaded(batch_ids):
+        if not hasattr(local, 'http'):
+            local.http = AuthorizedHttp(credentials, http=httplib2.Http())
+        if not execute(batch_ids, local.http):
+            # Start the next batch on a fresh connection
+            del local.http
+
+    pending = list(message_ids)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for attempt in range(FETCH_RETRIES + 1):
+            if attempt:
+                # Exponential backoff with jitter so concurrent clients spread out
+                delay = FETCH_BACKOFF * 2 ** (attempt - 1)
+                delay += random.uniform(0, delay)
+                logger.warning("Retrying %d messages in %.1fs", len(pending), delay)
+                time.sleep(delay)
+
+            retry.clear()
+            batches = [pending[start:start + BATCH_SIZE] for start in range(0, len(pending), BATCH_SIZE)]
+            if credentials is None or len(batches) == 1:
+                for batch_ids in batches:
+                    execute(batch_ids)
+            else:
+                list(executor.map(execute_threaded, batches))
+
+            pending = list(retry)
+            if not pending:
+                break
+
+    if pending:
+        logger.error("Giving up on %d messages after %d retries", len(pending), FETCH_RETRIES)
+        failed.update(pending)
+
+    return FetchResult(
+        [fetched[message_id] for message_id in message_ids if message_id in fetched],
+        [message_id for message_id in message_ids if message_id in gone],
+        [message_id for message_id in message_ids if message_id in failed]
+    )
+
+
+def store_messages(service, db_manager, message_ids, fetch_bodies=True, credentials=None):
+    """
+    Fetch messages by ID and store them in the database.
+
+    Args:
+        service: Authorized Gmail API service instance
+        db_manager: DatabaseManager instance
+        message_ids: List of Gmail message IDs
+        fetch_bodies: Store message bodies; when False only METADATA_HEADERS
+                      are downloaded (default: True)
+        credentials: Credentials for concurrent batches (see batch_get_messages)
+
+    Returns:
+        StoreResult: IDs stored, IDs that no longer exist and IDs that failed
+    """
+    if not message_ids:
+        return StoreResult([], [], [])
+
+    # Fetch up to BATCH_SIZE messages per HTTP round-trip, parsing each as it arrives.
+    # 'full' returns attachments as IDs only, where 'raw' would inline them, so
+    # each buffered batch sub-response stays about the size of the message text.
+    if fetch_bodies:
+        result = batch_get_messages(service, message_ids, message_format='full', parse=parse_message,
+                                    credentials=credentials)
+    else:
+        result = batch_get_messages(service, message_ids, message_format='metadata',
+                                    metadata_headers=METADATA_HEADERS, parse=parse_message,
+                                    credentials=credentials)
+    emails = result.messages
+    stored = [email_data['gmail_message_id'] for email_data in emails]
+
+    # Save the whole page in one transaction
+    if emails and not db_manager.save_emails_bulk(emails):
+        return StoreResult([], result.gone, result.failed + stored)
+
+    # Per-email details only at DEBUG; %-style args defer formatting until emitted
+    for email_data in emails:
+        logger.debug("Email ID: %s\nFrom: %s\nDate: %s\nSubject: %s\nPreview: %.100s...\n%s",
+                     email_data['gmail_message_id'], email_data['sender'],
+                     email_data['date_received'], email_data['subject'],
+                     email_data['snippet'], "-" * 80)
+
+    logger.info("Stored %d emails in database", len(emails))
+    return StoreResult(stored, result.gone, result.failed)
+
+
+def store_inbox(service, db_manager, max_results=10, fetch_bodies=True, credentials=None):
+    """
+    Store the newest inbox messages and refresh the labels of stored ones.
 
     Args:
         service: Authorized Gmail API service instance
         db_manager: DatabaseManager instance
         max_results: Maximum number of emails to fetch (default: 10)
+        fetch_bodies: Store message bodies; when False only METADATA_HEADERS
+                      are downloaded (default: True)
+        credentials: Credentials for concurrent batches (see batch_get_messages)
 
     Returns:
-        int: Number of emails processed
+        tuple: (number of emails processed, True if every listed message
+               was stored or refreshed)
     """
     try:
         # Call the Gmail API to fetch messages from inbox
@@ -309,85 +875,323 @@ def fetch_and_store_emails(service, db_manager, max_results=10):
         messages = results.get('messages', [])
 
         if not messages:
-            print("No messages found in inbox.")
-            return 0
+            logger.info("No messages found in inbox.")
+            return 0, True
+
+        logger.info("Found %d messages in inbox", len(messages))
+
+        # Only new messages need their bodies downloaded
+        message_ids = [msg['id'] for msg in messages]
+        stored_ids = db_manager.get_stored_ids(message_ids)
+        new_ids = [message_id for message_id in message_ids if message_id not in stored_ids]
+        existing_ids = [message_id for message_id in message_ids if message_id in stored_ids]
+        result = store_messages(service, db_manager, new_ids, fetch_bodies, credentials)
+        emails_count = len(result.stored)
+        complete = not result.failed
+
+        # Stored messages only need their labels refreshed
+        if existing_ids:
+            labels = batch_get_messages(service, existing_ids, message_format='minimal',
+                                        parse=lambda message: (message['id'], message.get('labelIds', [])),
+                                        credentials=credentials)
+            if db_manager.update_labels(dict(labels.messages)):
+                logger.info("Refreshed labels of %d stored emails", len(labels.messages))
+                emails_count += len(labels.messages)
+                complete = complete and not labels.failed
+            else:
+                complete = False
+
+        return emails_count, complete
+
+    except HttpError as error:
+        logger.error("An error occurred while fetching emails: %s", error)
+        return 0, False
 
-        print(f"\nFound {len(messages)} messages in inbox:")
-        print("-" * 80)
 
-        emails_processed = 0
+def fetch_and_store_emails(service, db_manager, max_results=10, fetch_bodies=True, credentials=None):
+    """
+    Fetches emails from the user's inbox and stores them in the database.
 
-        for msg in messages:
-            try:
-                # Fetch the full message details
-                message = service.users().messages().get(
+    Args:
+        service: Authorized Gmail API service instance
+        db_manager: DatabaseManager instance
+        max_results: Maximum number of emails to fetch (default: 10)
+        fetch_bodies: Store message bodies; when False only METADATA_HEADERS
+                      are downloaded (default: True)
+        credentials: Credentials for concurrent batches (see batch_get_messages)
+
+    Returns:
+        int: Number of emails processed
+    """
+    return store_inbox(service, db_manager, max_results, fetch_bodies, credentials)[0]
+
+
+def sync_emails(service, db_manager, user_email, max_results=10, fetch_bodies=True, credentials=None):
+    """
+    Bring the database up to date with the inbox using Gmail's history API.
+
+    The first run (or a run whose saved historyId has expired) stores the
+    newest max_results inbox messages as a baseline. Later runs only fetch
+    messages added to the inbox since the saved historyId and update the
+    labels of stored messages that changed.
+
+    Args:
+        service: Authorized Gmail API service instance
+        db_manager: DatabaseManager instance
+        user_email: User's email address
+        max_results: Messages stored by a baseline sync (default: 10)
+        fetch_bodies: Store message bodies; when False only METADATA_HEADERS
+                      are downloaded (default: True)
+        credentials: Credentials for concurrent batches (see batch_get_messages)
+
+    Returns:
+        int: Number of emails stored
+    """
+    history_id = db_manager.get_history_id(user_email)
+
+    if history_id is not None:
+        try:
+            added = {}
+            label_changes = {}
+            page_token = None
+
+            while True:
+                response = service.users().history().list(
                     userId='me',
-                    id=msg['id'],
-                    format='full'
+                    startHistoryId=history_id,
+                    historyTypes=['messageAdded', 'labelAdded', 'labelRemoved'],
+                    maxResults=HISTORY_PAGE_SIZE,
+                    pageToken=page_token
                 ).execute()
 
-                # Extract headers
-                headers = message['payload']['headers']
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-                recipient = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-                cc = next((h['value'] for h in headers if h['name'].lower() == 'cc'), None)
-                bcc = next((h['value'] for h in headers if h['name'].lower() == 'bcc'), None)
-                date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), None)
-
-                # Parse date
-                date_received = parse_email_date(date_str) if date_str else None
-
-                # Extract body
-                text_body, html_body = get_email_body(message['payload'])
-
-                # Extract labels and flags
-                labels = message.get('labelIds', [])
-                is_read = 'UNREAD' not in labels
-                is_starred = 'STARRED' in labels
-
-                # Prepare email data for database
-                email_data = {
-                    'gmail_message_id': message['id'],
-                    'thread_id': message.get('threadId'),
-                    'subject': subject,
-                    'sender': sender,
-                    'recipient': recipient,
-                    'cc': cc,
-                    'bcc': bcc,
-                    'date_received': date_received,
-                    'snippet': message.get('snippet', ''),
-                    'body_text': text_body,
-                    'body_html': html_body,
-                    'labels': labels,
-                    'is_read': is_read,
-                    'is_starred': is_starred
-                }
+                for record in response.get('history', []):
+                    for item in record.get('messagesAdded', []):
+                        if 'INBOX' in item['message'].get('labelIds', []):
+                            added[item['message']['id']] = None
+                    # Records are in history order, so the last one seen holds the current labels
+                    for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                        label_changes[item['message']['id']] = item['message'].get('labelIds', [])
+
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+
+            # New messages are fetched with their current labels anyway
+            for message_id in added:
+                label_changes.pop(message_id, None)
+
+            logger.info("Found %d new messages and %d label changes since last sync",
+                        len(added), len(label_changes))
+
+            result = store_messages(service, db_manager, list(added), fetch_bodies, credentials)
+
+            # Label changes don't depend on the new messages, so apply them either way
+            labels_updated = db_manager.update_labels(label_changes)
+
+            # Only move the sync position forward once every change is stored;
+            # messages deleted since (404) need nothing more
+            if result.failed:
+                logger.warning("%d new messages were not stored; the next sync will retry them",
+                               len(result.failed))
+            elif labels_updated:
+                db_manager.save_history_id(user_email, response['historyId'])
+            return len(result.stored)
+
+        except HttpError as error:
+            # Gmail keeps history for about a week; an older historyId returns 404
+            if error.resp.status != 404:
+                logger.error("An error occurred while syncing emails: %s", error)
+                return 0
+            logger.warning("Saved history is too old, doing a full sync...")
+
+    # Baseline: note the mailbox position before listing so nothing is missed
+    try:
+        profile = service.users().getProfile(userId='me').execute()
+    except HttpError as error:
+        logger.error("An error occurred while fetching emails: %s", error)
+        return 0
 
-                # Save to database
-                db_manager.save_email(email_data)
+    # A baseline with failures isn't saved, so the next run redoes it; messages
+    # stored this time are skipped then
+    emails_count, complete = store_inbox(service, db_manager, max_results, fetch_bodies, credentials)
+    if complete:
+        db_manager.save_history_id(user_email, profile['historyId'])
+    else:
+        logger.warning("Some inbox messages were not stored; the next sync will redo the baseline")
+    return emails_count
 
-                # Print email details
-                print(f"\nEmail ID: {email_data['gmail_message_id']}")
-                print(f"From: {email_data['sender']}")
-                print(f"Date: {date_str}")
-                print(f"Subject: {email_data['subject']}")
-                print(f"Preview: {email_data['snippet'][:100]}...")
-                print(f"Stored in database: ✓")
-                print("-" * 80)
 
-                emails_processed += 1
+def parse_imap_fetch(meta, raw):
+    """
+    Convert one IMAP FETCH response into a Gmail message resource.
 
-            except Exception as e:
-                print(f"Error processing message {msg['id']}: {e}")
-                continue
+    Args:
+        meta: FETCH response line (UID, FLAGS and X-GM-* items)
+        raw: RFC 822 source of the message
 
-        return emails_processed
+    Returns:
+        dict: Message resource with 'raw' holding the RFC 822 bytes
+    """
+    items = {}
+    for match in IMAP_FETCH_ITEM.finditer(meta):
+        if match.group(1):
+            items[match.group(1)] = match.group(2)
+        else:
+            items[match.group(3)] = match.group(4)
+
+    # Backfill reads INBOX, which X-GM-LABELS leaves out for the selected mailbox
+    labels = ['INBOX']
+    for label in items.get(b'X-GM-LABELS', b'').decode('utf-8', errors='ignore').split():
+        label = label.strip('"').replace('\\\\', '\\')
+        if label in IMAP_SYSTEM_LABELS:
+            labels.append(IMAP_SYSTEM_LABELS[label])
+    flags = items.get(b'FLAGS', b'').split()
+    if b'\\Seen' not in flags:
+        labels.append('UNREAD')
+    if b'\\Flagged' in flags and 'STARRED' not in labels:
+        labels.append('STARRED')
+
+    # X-GM-MSGID and X-GM-THRID are the API's message and thread IDs in decimal
+    return {
+        'id': format(int(items[b'X-GM-MSGID']), 'x'),
+        'threadId': format(int(items[b'X-GM-THRID']), 'x') if b'X-GM-THRID' in items else None,
+        'labelIds': labels,
+        'raw': raw
+    }
+
+
+def group_imap_uids(uids, sizes):
+    """
+    Split UIDs into FETCH sets bounded by IMAP_FETCH_SIZE and IMAP_FETCH_BYTES.
 
-    except HttpError as error:
-        print(f"An error occurred while fetching emails: {error}")
+    Args:
+        uids: Message UIDs (bytes) in mailbox order
+        sizes: Dict mapping UID to its RFC822.SIZE
+
+    Returns:
+        list: Lists of UIDs, one per FETCH
+    """
+    groups = []
+    group = []
+    group_bytes = 0
+    for uid in uids:
+        size = sizes.get(uid, 0)
+        if group and (len(group) == IMAP_FETCH_SIZE or group_bytes + size > IMAP_FETCH_BYTES):
+            groups.append(group)
+            group = []
+            group_bytes = 0
+        group.append(uid)
+        group_bytes += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def backfill_via_imap(db_manager, user_email, creds):
+    """
+    Bulk-load the whole inbox over IMAP instead of per-message API calls.
+
+    Message sizes are read first so each UID FETCH stays within
+    IMAP_FETCH_SIZE messages and IMAP_FETCH_BYTES; pages are stored as they
+    arrive, all on one connection. Only system labels are mapped to label
+    IDs, so backfilled messages lack user and CATEGORY_* labels until a
+    later label change on the message reaches a history sync.
+
+    Args:
+        db_manager: DatabaseManager instance
+        user_email: User's email address
+        creds: Google OAuth credentials granted IMAP_SCOPE
+
+    Returns:
+        int: Number of emails stored
+    """
+    if not creds.has_scopes([IMAP_SCOPE]):
+        logger.error("IMAP backfill needs a token with the %s scope", IMAP_SCOPE)
         return 0
 
+    if not creds.valid:
+        creds.refresh(_AUTH_REQUEST)
+
+    emails_count = 0
+    imap = None
+    try:
+        imap = imaplib.IMAP4_SSL(IMAP_HOST)
+        imap.authenticate('XOAUTH2', lambda _: f'user={user_email}\x01auth=Bearer {creds.token}\x01\x01'.encode())
+        imap.select('INBOX', readonly=True)
+
+        _, data = imap.uid('SEARCH', None, 'ALL')
+        uids = data[0].split()
+        logger.info("Found %d messages in inbox for IMAP backfill", len(uids))
+        if not uids:
+            return 0
+
+        sizes = {}
+        _, data = imap.uid('FETCH', b'%s:%s' % (uids[0], uids[-1]), '(RFC822.SIZE)')
+        for line in data:
+            if not isinstance(line, bytes):
+                continue
+            items = dict(match.group(1, 2) for match in IMAP_FETCH_ITEM.finditer(line) if match.group(1))
+            if b'UID' in items and b'RFC822.SIZE' in items:
+                sizes[items[b'UID']] = int(items[b'RFC822.SIZE'])
+
+        for group in group_imap_uids(uids, sizes):
+            # BODY.PEEK[] leaves \Seen alone, unlike RFC822
+            _, data = imap.uid('FETCH', b','.join(group),
+                               '(UID FLAGS X-GM-MSGID X-GM-THRID X-GM-LABELS BODY.PEEK[])')
+
+            emails = []
+            for index, item in enumerate(data):
+                if not isinstance(item, tuple):
+                    continue
+                meta, raw = item
+                # Items after the literal arrive in the next element
+                following = data[index + 1] if index + 1 < len(data) else b''
+                if isinstance(following, bytes):
+                    meta += following
+                try:
+                    emails.append(parse_message(parse_imap_fetch(meta, raw)))
+                except Exception as e:
+                    logger.error("Error processing IMAP message: %s", e)
+
+            emails_count += db_manager.save_emails_bulk(emails)
+            logger.info("Stored %d of %d messages", emails_count, len(uids))
+
+    except (imaplib.IMAP4.error, OSError) as e:
+        # OSError covers socket and SSL failures, including while connecting
+        logger.error("IMAP backfill failed: %s", e)
+    finally:
+        if imap is not None:
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+    return emails_count
+
+
+def configure_logging():
+    """
+    Send log records through a queue to a handler on a background thread.
+
+    Callers only enqueue records; writing to stdout happens on the listener
+    thread.
+
+    Returns:
+        QueueListener: Started listener; stop it to flush pending records
+    """
+    log_queue = queue.SimpleQueue()
+
+    # The queue handler formats each record before enqueueing it
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(message)s',
+        handlers=[QueueHandler(log_queue)]
+    )
+
+    listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    return listener
+
 
 def main():
     """
@@ -396,36 +1200,43 @@ def main():
     print("Gmail API Email Fetcher with PostgreSQL Storage")
     print("=" * 80)
 
-    # Get user email from environment
-    user_email = os.getenv('GMAIL_USER_EMAIL')
-    if not user_email:
-        print("Error: GMAIL_USER_EMAIL not set in .env file")
-        return
-
-    # Initialize database manager
-    try:
-        db_manager = DatabaseManager()
-    except Exception as e:
-        print(f"Failed to connect to database: {e}")
-        print("Please check your .env file and database configuration")
-        return
-
+    listener = configure_logging()
     try:
-        # Authenticate and get service object
-        service = authenticate_gmail(db_manager, user_email)
+        # Get user email from environment
+        user_email = os.getenv('GMAIL_USER_EMAIL')
+        if not user_email:
+            logger.error("Error: GMAIL_USER_EMAIL not set in .env file")
+            return
 
-        if service is None:
-            print("Failed to authenticate. Exiting.")
+        # Initialize database manager
+        try:
+            db_manager = DatabaseManager()
+        except Exception as e:
+            logger.error("Failed to connect to database: %s", e)
+            logger.error("Please check your .env file and database configuration")
             return
 
-        # Fetch and store emails (change max_results as needed)
-        emails_count = fetch_and_store_emails(service, db_manager, max_results=10)
+        try:
+            # Authenticate and get service object
+            service = authenticate_gmail(db_manager, user_email)
+
+            if service is None:
+                logger.error("Failed to authenticate. Exiting.")
+                return
 
-        print(f"\n\nTotal emails processed and stored: {emails_count}")
+            # Sync new emails and label changes (change max_results as needed)
+            emails_count = sync_emails(service, db_manager, user_email, max_results=10,
+                                       credentials=_CREDS_CACHE.get(user_email))
+
+            logger.info("Total emails processed and stored: %d", emails_count)
+
+        finally:
+            # Close database connection
+            db_manager.close()
 
     finally:
-        # Close database connection
-        db_manager.close()
+        # Flush queued log records before exiting
+        listener.stop()
 
 
 if __name__ == '__main__':
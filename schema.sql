@@ -38,6 +38,13 @@ CREATE TABLE IF NOT EXISTS emails (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Table to store the Gmail history position reached by incremental sync
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_email VARCHAR(255) PRIMARY KEY,
+    last_history_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Table to store email attachments
 CREATE TABLE IF NOT EXISTS attachments (
     id SERIAL PRIMARY KEY,
@@ -51,11 +58,17 @@ CREATE TABLE IF NOT EXISTS attachments (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Trigram support so the email processor's substring filters can use indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_emails_gmail_message_id ON emails(gmail_message_id);
 CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails(sender);
 CREATE INDEX IF NOT EXISTS idx_emails_date_received ON emails(date_received DESC);
 CREATE INDEX IF NOT EXISTS idx_emails_labels ON emails USING GIN(labels);
+-- Serve rule filters like lower(COALESCE(subject, '')) LIKE '%invoice%' (expressions must match email_processor.py)
+CREATE INDEX IF NOT EXISTS idx_emails_subject_trgm ON emails USING GIN(lower(COALESCE(subject, '')) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_emails_sender_trgm ON emails USING GIN(lower(COALESCE(sender, '')) gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_attachments_email_id ON attachments(email_id);
 CREATE INDEX IF NOT EXISTS idx_oauth_tokens_user_email ON oauth_tokens(user_email);
 
@@ -69,11 +82,13 @@ END;
 $$ LANGUAGE plpgsql;
 
 -- Triggers to automatically update updated_at
+DROP TRIGGER IF EXISTS update_emails_updated_at ON emails;
 CREATE TRIGGER update_emails_updated_at
     BEFORE UPDATE ON emails
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_oauth_tokens_updated_at ON oauth_tokens;
 CREATE TRIGGER update_oauth_tokens_updated_at
     BEFORE UPDATE ON oauth_tokens
     FOR EACH ROW
@@ -83,6 +98,7 @@ CREATE TRIGGER update_oauth_tokens_updated_at
 COMMENT ON TABLE oauth_tokens IS 'Stores OAuth 2.0 tokens for Gmail API authentication';
 COMMENT ON TABLE emails IS 'Stores Gmail messages with metadata and content';
 COMMENT ON TABLE attachments IS 'Stores email attachments';
+COMMENT ON TABLE sync_state IS 'Stores the last Gmail historyId synced per user';
 
 COMMENT ON COLUMN oauth_tokens.token IS 'OAuth access token';
 COMMENT ON COLUMN oauth_tokens.refresh_token IS 'OAuth refresh token for renewing access';
@@ -0,0 +1,89 @@
+"""
+Check that the Hyperscan and Aho-Corasick matchers report the same needles.
+"""
+
+import json
+import random
+
+import pytest
+
+import email_processor
+from email_processor import EmailRuleProcessor
+
+hyperscan = pytest.importorskip('hyperscan')
+
+# Small alphabet so random needles overlap and repeat inside the texts
+ALPHABET = 'aby.c@ ß'
+
+
+def make_processor(tmp_path, monkeypatch, needles):
+    """
+    Build a processor with one subject-contains rule per needle, without a database.
+
+    Args:
+        tmp_path: pytest temporary directory for the rules file
+        monkeypatch: pytest monkeypatch fixture
+        needles: Subject needles
+
+    Returns:
+        EmailRuleProcessor
+    """
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text(json.dumps({'rules': [
+        {
+            'description': f'Needle {index}',
+            'predicate': 'any',
+            'conditions': [{'field': 'subject', 'predicate': 'contains', 'value': needle}],
+            'actions': [{'type': 'mark_read'}]
+        }
+        for index, needle in enumerate(needles)
+    ]}))
+    monkeypatch.setattr(EmailRuleProcessor, 'connect_database', lambda self: None)
+    return EmailRuleProcessor(str(rules_file))
+
+
+def scan_both(processor, monkeypatch, subjects):
+    """
+    Scan subjects with the Hyperscan matchers, then with Aho-Corasick ones.
+
+    Args:
+        processor: EmailRuleProcessor built while hyperscan is available
+        monkeypatch: pytest monkeypatch fixture
+        subjects: Subject lines to scan
+
+    Returns:
+        tuple: (Hyperscan bitsets, Aho-Corasick bitsets)
+    """
+    fields = [processor.lowercase_fields({'subject': subject}) for subject in subjects]
+    hyperscan_matched = [processor.scan_email(email_fields) for email_fields in fields]
+
+    monkeypatch.setattr(email_processor, 'hyperscan', None)
+    processor.matchers = processor._build_matchers()
+    ahocorasick_matched = [processor.scan_email(email_fields) for email_fields in fields]
+    return hyperscan_matched, ahocorasick_matched
+
+
+def test_overlapping_needles_all_reported(tmp_path, monkeypatch):
+    needles = ['.@cbyy', '.', ' .', 'byy   ']
+    # ' .' starts at offset 55, where HS_FLAG_SINGLEMATCH was seen to drop it
+    subject = 'a' * 55 + ' .@cbyy   '
+    processor = make_processor(tmp_path, monkeypatch, needles)
+
+    hyperscan_matched, ahocorasick_matched = scan_both(processor, monkeypatch, [subject])
+
+    expected = 0
+    for needle in needles:
+        expected |= 1 << processor.needle_ids[('subject', needle)]
+    assert hyperscan_matched == ahocorasick_matched == [expected]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_hyperscan_matches_ahocorasick(tmp_path, monkeypatch, seed):
+    rng = random.Random(seed)
+    needles = sorted({''.join(rng.choices(ALPHABET, k=rng.randint(1, 6))) for _ in range(30)})
+    subjects = [''.join(rng.choices(ALPHABET, k=rng.randint(0, 300))) for _ in range(200)]
+    processor = make_processor(tmp_path, monkeypatch, needles)
+
+    hyperscan_matched, ahocorasick_matched = scan_both(processor, monkeypatch, subjects)
+
+    assert hyperscan_matched == ahocorasick_matched